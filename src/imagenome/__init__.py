@@ -1,3 +1,11 @@
+import os
+
+# Pin BLAS libraries to a single thread, so that the worker processes used for parallel processing do not oversubscribe
+# the CPU. These must be set before numpy is first imported (through spaCy) and can be overridden by the environment
+os.environ.setdefault("OPENBLAS_NUM_THREADS", "1")
+os.environ.setdefault("MKL_NUM_THREADS", "1")
+os.environ.setdefault("OMP_NUM_THREADS", "1")
+
 from .textclass import TextClassification
 from .ner import Ner
 from .parser import Parser
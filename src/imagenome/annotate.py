@@ -15,9 +15,26 @@
 
 import spacy
 import mysql.connector
+from itertools import chain, tee
 
 from .utils import timer
 
+# Entity labels of the NER model stored in the annotation output table, in column order
+FIELD_ORDER = ("RADIOTRACER_S", "RADIOTRACER_L", "PROTEIN", "DNA", "CELL_LINE")
+
+# Columns of the annotation output table filled by Annotate.annotate, matching the order of the inserted values
+FIELDS = ("TAB_ID", "title", "abstract", "journal", "pmid",
+          "radiotracer_1_abstract", "radiotracer_2_abstract", "protein_1_abstract", "DNA_1_abstract",
+          "cell_line_1_abstract",
+          "radiotracer_1_title", "radiotracer_2_title", "protein_1_title", "DNA_1_title", "cell_line_1_title")
+
+
+def _str_or_none(value):
+    """
+    Converts the input value to str, keeping None values (stored as NULL in the database)
+    """
+    return None if value is None else str(value)
+
 
 class Annotate:
     """
@@ -37,25 +54,26 @@ class Annotate:
         """
         self.output_table = ""
         self.query_table = query_table
-        self.model = spacy.load(input_model_path)
-        self.mydb = mysql.connector.connect(host="localhost", user="root", password=password, database="imagenome_db")
-        self.mycursor = self.mydb.cursor(buffered=True)
-        self.mytables = []
-
-        # Get currently existing tables and store them in list
+        # Only the "ner" component is used for annotation
+        self.model = spacy.load(input_model_path, disable=["tagger", "parser"])
+        self.mydb = mysql.connector.connect(host="localhost", user="root", password=password, database="imagenome_db",
+                                            autocommit=False)
+        self.mycursor = self.mydb.cursor()
+        # Separate connection used to stream the query table while annotations are inserted through self.mydb
+        self.mydb_stream = mysql.connector.connect(host="localhost", user="root", password=password,
+                                                   database="imagenome_db")
+        self.mytables = set()
+
+        # Get currently existing tables and store them in a set
         self.update_table_list()
 
     def update_table_list(self):
         """
-        Updates the list of tables to the ones defined in the MySQL "imagenome_db" database
+        Updates the set of tables to the ones defined in the MySQL "imagenome_db" database
         """
 
-        self.mytables = []
         self.mycursor.execute("Show tables;")
-        myresult = self.mycursor.fetchall()
-        if len(myresult) > 0:
-            for table in myresult:
-                self.mytables.append(table[0])
+        self.mytables = {table[0] for table in self.mycursor.fetchall()}
 
     def create_table(self, output_name="imagenome_ann"):
         """
@@ -82,13 +100,41 @@ class Annotate:
         self.query = ("SELECT TAB_ID, title, abstract, journal, pmid FROM `{}`".format(self.query_table))
 
         self.mycursor.execute(self.sql_create)
-        self.mycursor.execute(self.query)
 
-        # Update tables list
-        self.update_table_list()
+        # Update tables set
+        self.mytables.add(self.output_table)
+
+    def _insert_batch(self, cursor, cursor_prepared, sql, batch):
+        """
+        Inserts a batch of annotated entries into the output table using a single transaction. If the batch insertion
+        fails, the transaction is rolled back and the entries are inserted one by one through a server-side prepared
+        statement, so that a faulty entry does not prevent the rest of the batch from being stored
+
+        :param cursor: cursor used to write into the output table
+        :type cursor: mysql.connector cursor object
+        :param cursor_prepared: prepared statement cursor used to write single entries into the output table
+        :type cursor_prepared: mysql.connector prepared cursor object
+        :param sql: parameterized INSERT statement
+        :type sql: str
+        :param batch: list of entries to insert, each one of them matching the INSERT statement parameters
+        :type batch: list(tuple)
+        """
+        try:
+            # mysql.connector rewrites INSERT statements into a single multi-row INSERT ... VALUES (...), (...)
+            cursor.executemany(sql, batch)
+            self.mydb.commit()
+        except mysql.connector.Error:
+            self.mydb.rollback()
+            for values in batch:
+                try:
+                    cursor_prepared.execute(sql, values)
+                    self.mydb.commit()
+                except mysql.connector.Error:
+                    self.mydb.rollback()
+                    print("Error transfering entry with PMID: " + str(values[4]))
 
     @timer('Performing annotations on the query database table using NER model... ')
-    def annotate(self, output_name="imagenome_ann"):
+    def annotate(self, output_name="imagenome_ann", batch_size=1000, pipe_batch_size=256, fetch_size=1000):
         """
         Performs machine annotation on the abstracts defined in the query or source table of the "imagenome_db"
         MySQL database with the help of the NER model, and inserts them into a new MySQL database that has the following
@@ -97,6 +143,12 @@ class Annotate:
 
         :param output_name: name of the annotation output table, defaults to "imagenome_ann"
         :type output_name: str, optional
+        :param batch_size: number of annotated entries inserted into the output table per transaction, defaults to 1000
+        :type batch_size: int, optional
+        :param pipe_batch_size: number of texts processed together by the NER model, defaults to 256
+        :type pipe_batch_size: int, optional
+        :param fetch_size: number of rows fetched at once from the query table, defaults to 1000
+        :type fetch_size: int, optional
         """
         self.output_table = output_name
         if self.output_table not in self.mytables:
@@ -106,67 +158,55 @@ class Annotate:
 
         self.query = ("SELECT TAB_ID, title, abstract, journal, pmid FROM `{}`".format(self.query_table))
 
-        self.mycursor.execute(self.query)
+        # Stream the query table with an unbuffered cursor, so that only fetch_size rows are held in memory at once
+        mycursor_stream = self.mydb_stream.cursor(buffered=False)
+        mycursor_stream.arraysize = fetch_size
+        mycursor_stream.execute(self.query)
+
+        add_paper = "INSERT INTO `{}` (`{}`) VALUES ({})".format(self.output_table, "`, `".join(FIELDS),
+                                                                 ", ".join(["%s"] * len(FIELDS)))
 
-        add_paper = "INSERT INTO `{}`  (`TAB_ID`, `title`, `abstract`," \
-                    " `journal`, `pmid`, `radiotracer_1_abstract`, `radiotracer_2_abstract`, " \
-                    "`protein_1_abstract`, `DNA_1_abstract`, `cell_line_1_abstract`, `radiotracer_1_title`, `radiotracer_2_title`, " \
-                    "`protein_1_title`, `DNA_1_title`, `cell_line_1_title`) VALUES (".format(self.output_table)\
-                    + "%s," *14 + "%s)"
+        # Stream abstracts and titles through the NER model in batches, carrying the table row along the abstracts
+        rows = chain.from_iterable(iter(lambda: mycursor_stream.fetchmany(fetch_size), []))
+        rows_abstract, rows_title = tee(rows)
+        abstract_docs = self.model.pipe(((row[2], row) for row in rows_abstract), batch_size=pipe_batch_size,
+                                        as_tuples=True)
+        title_docs = self.model.pipe((row[1] for row in rows_title), batch_size=pipe_batch_size)
 
+        # The batches are written as multi-row INSERTs, which a prepared statement cursor cannot do, so the prepared
+        # cursor (parsed once by the server and reused) is only used to insert entries one by one if a batch fails
         mycursor_ann = self.mydb.cursor(buffered=True)
-        for (TAB_ID, title, abstract, journal, pmid) in self.mycursor:
-            doc = self.model(abstract)
-            doc_ents = []
-            dict_ = {}
-            for ent in doc.ents:
-                doc_ents.append(ent.label_)
-                dict_[str(ent.label_)] = str(ent.text)
-            default_keys = ["RADIOTRACER_S", "RADIOTRACER_L", "PROTEIN", "DNA", "CELL_LINE"]
-            null_keys = list(set(default_keys) - set(list(dict_.keys())))
-
-            for keys in null_keys:
-                dict_[str(keys)] = None
-
-            doc2 = self.model(title)
-            doc_ents2 = []
-            dict2_ = {}
-            for ent in doc2.ents:
-                doc_ents2.append(ent.label_)
-                dict2_[str(ent.label_)] = str(ent.text)
-            default_keys = ["RADIOTRACER_S", "RADIOTRACER_L", "PROTEIN", "DNA", "CELL_LINE"]
-            null_keys2 = list(set(default_keys) - set(list(dict2_.keys())))
-
-            for keys in null_keys2:
-                dict2_[str(keys)] = None
-            values = (TAB_ID, str(title), str(abstract), str(journal), str(pmid),
-                  str(dict_["RADIOTRACER_S"]),
-                  str(dict_["RADIOTRACER_L"]), str(dict_["PROTEIN"]),
-                    str(dict_["DNA"]), str(dict2_["CELL_LINE"]), str(dict2_["RADIOTRACER_S"]),
-                  str(dict2_["RADIOTRACER_L"]), str(dict2_["PROTEIN"]),
-                    str(dict2_["DNA"]), str(dict2_["CELL_LINE"]))
-
-            dec_values = []
-            for elem in values:
-                if elem == 'None':
-                    dec_values.append(None)
-                else:
-                    dec_values.append(elem)
-            try:
-                mycursor_ann.execute(add_paper, dec_values)
-                self.mydb.commit()
-            except:
-                print("Error transfering entry with PMID: " + str(pmid))
-                pass
+        mycursor_prep = self.mydb.cursor(prepared=True)
+        batch = []
+        for (doc, (TAB_ID, title, abstract, journal, pmid)), doc2 in zip(abstract_docs, title_docs):
+            # Texts of the entities found for each label (None when missing), following the column order
+            ents_abstract = {ent.label_: ent.text for ent in doc.ents}
+            ents_title = {ent.label_: ent.text for ent in doc2.ents}
+            values = (TAB_ID, _str_or_none(title), _str_or_none(abstract), _str_or_none(journal), _str_or_none(pmid)) \
+                + tuple(ents_abstract.get(key) for key in FIELD_ORDER) \
+                + tuple(ents_title.get(key) for key in FIELD_ORDER)
+            batch.append(values)
+
+            if len(batch) >= batch_size:
+                self._insert_batch(mycursor_ann, mycursor_prep, add_paper, batch)
+                batch.clear()
+
+        # Insert remaining entries
+        if batch:
+            self._insert_batch(mycursor_ann, mycursor_prep, add_paper, batch)
 
         # Close cursors and database connection
         mycursor_ann.close()
+        mycursor_prep.close()
+        mycursor_stream.close()
         self.mycursor.close()
         self.mydb.close()
+        self.mydb_stream.close()
 
     def close(self):
         """
         Closes the open database connection and cursors initialised by default when instantiating the object
         """
         self.mycursor.close()
-        self.mydb.close()
\ No newline at end of file
+        self.mydb.close()
+        self.mydb_stream.close()
\ No newline at end of file
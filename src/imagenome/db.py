@@ -15,12 +15,34 @@
 
 import json
 import os.path
+import tempfile
 import pandas as pd
+import pyarrow.parquet as pq
 from glob import glob
 import mysql.connector
 
 from .utils import timer
 
+# Characters escaped in the files bulk loaded with LOAD DATA, following MySQL's default escaping (ESCAPED BY '\\')
+_LOAD_DATA_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r", "\0": "\\0"})
+
+
+def _load_data_field(value):
+    """
+    Formats a value as a field of a file bulk loaded with LOAD DATA. Missing values are written as \\N, as fields are
+    not enclosed and a field holding the word NULL is then read as the "NULL" string
+
+    :param value: value to format
+    :type value: object
+    :rtype: str
+    """
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        # Store booleans the same way the connector does (0/1)
+        value = int(value)
+    return str(value).translate(_LOAD_DATA_ESCAPES)
+
 
 class SqlDb:
     """
@@ -50,25 +72,21 @@ class SqlDb:
         self.host = host
         self.user = user
         self.database = database
-        self.mydb = mysql.connector.connect(host=self.host, user=self.user, password=password, database=self.database)
+        self.mydb = mysql.connector.connect(host=self.host, user=self.user, password=password, database=self.database,
+                                            autocommit=False, allow_local_infile=True)
         self.mycursor = self.mydb.cursor()
         self.parquet_path = os.path.abspath(parquet_path)
         self.parquet = glob(self.parquet_path + '/*')
         self.json_path = os.path.abspath(json_path)
         self.json = glob(self.json_path + '/*')
-        self.table = pd.read_parquet(self.parquet[0], engine='pyarrow')
-        self.table["class_value"] = 0
-        self.table["clean_abstract"] = 0
-        self.table["clean_title"] = 0
-        self.mytables = []
+        # Only the column names of the parsed .parquet files are needed, so they are read from the file schema
+        # without loading any data
+        self.table = pd.DataFrame(columns=pq.read_schema(self.parquet[0]).names
+                                  + ["class_value", "clean_abstract", "clean_title"])
 
-        # Get currently existing tables and store them in list
+        # Get currently existing tables and store them in a set
         self.mycursor.execute("Show tables;")
-        myresult = self.mycursor.fetchall()
-
-        if len(myresult) > 0:
-            for table in myresult:
-                self.mytables.append(table[0])
+        self.mytables = {table[0] for table in self.mycursor.fetchall()}
 
     def create_table(self, name="imagenome"):
         """
@@ -92,12 +110,52 @@ class SqlDb:
                  "DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci  PARTITION BY KEY(`TAB_ID`) " \
                  "PARTITIONS 220;".format(name, ddl[:-1])
         self.mycursor.execute(sql_create)
-        self.mytables.append(name)
+        self.mytables.add(name)
+
+    def _enable_local_infile(self):
+        """
+        Checks whether the server accepts loading local files, enabling it if it is not. Enabling it is a server-wide
+        setting that requires the SUPER or SYSTEM_VARIABLES_ADMIN privilege, so the user is warned in both cases
+
+        :return: `True` if local files can be loaded, `False` otherwise
+        :rtype: bool
+        """
+        self.mycursor.execute("SELECT @@GLOBAL.local_infile;")
+        if int(self.mycursor.fetchone()[0]):
+            return True
+        try:
+            self.mycursor.execute("SET GLOBAL local_infile=1;")
+        except mysql.connector.Error as err:
+            print("WARNING! Loading local files is disabled on the server and could not be enabled ({}). The table "
+                  "will be filled with INSERT statements instead".format(err))
+            return False
+        print("WARNING! The server-wide 'local_infile' setting has been enabled to bulk load the data")
+        return True
+
+    def _report_load_warnings(self, filename, n_rows):
+        """
+        Reports the rows skipped or truncated by the server while loading a file, as LOAD DATA turns data errors into
+        warnings instead of raising them
+
+        :param filename: path to the loaded .json file
+        :type filename: str
+        :param n_rows: number of rows in the loaded file
+        :type n_rows: int
+        """
+        if self.mycursor.rowcount != n_rows:
+            print("WARNING! Only {} out of {} entries from file {} were loaded".format(self.mycursor.rowcount, n_rows,
+                                                                                       filename))
+        if self.mycursor.warning_count:
+            self.mycursor.execute("SHOW WARNINGS;")
+            for level, code, message in self.mycursor.fetchall():
+                print("WARNING! {} {} loading file {}: {}".format(level, code, filename, message))
 
     @timer('Filling database table with TC-filtered files... ')
     def fill_table(self, name="imagenome"):
         """
-        Fills a MySQL table with the data from the filtered .parquet file(s).
+        Fills a MySQL table with the data from the filtered .parquet file(s). Each file is bulk loaded with LOAD DATA
+        LOCAL INFILE, or inserted with a single multi-row INSERT statement if the server does not accept loading local
+        files.
 
         :param name: name of the table to be filled, defaults to "imagenome"
         :type name: str, optional
@@ -107,23 +165,52 @@ class SqlDb:
                   "using 'SqlDb.create_table()'")
             return
 
-        for filename in self.json:
-            with open(filename) as n:
-                self.data = json.load(n)
-
-            cols = "`,`".join([str(i) for i in self.table.columns.tolist()])
-            self.sql = "INSERT INTO `{}` (`".format(name) + str(cols) + "`) VALUES (" + \
-                       "%s,"*(len(self.table.columns.tolist())-1) + "%s)"
-
-            #Store all the values in a dictionary
-            for key, value in self.data.items():
-                row = value
-                row["clean_abstract"] = ""
-                row["clean_title"] = ""
-
-                self.row = tuple(row.values())
-                self.mycursor.execute(self.sql, tuple(self.row))
+        # Loading local files must be allowed on the server side (the client side is enabled when connecting)
+        local_infile = self._enable_local_infile()
+
+        # The table schema is fixed, so the column order and the loading statement are built only once
+        cols_list = self.table.columns.tolist()
+        fd, tmp_path = tempfile.mkstemp(suffix=".tsv")
+        os.close(fd)
+        cols = "`,`".join([str(i) for i in cols_list])
+        if local_infile:
+            self.sql = "LOAD DATA LOCAL INFILE '{}' INTO TABLE `{}` CHARACTER SET utf8mb4 FIELDS TERMINATED BY " \
+                       "'\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n' (`{}`)".format(tmp_path, name, cols)
+        else:
+            self.sql = "INSERT INTO `{}` (`{}`) VALUES ({})".format(name, cols, ", ".join(["%s"] * len(cols_list)))
+
+        try:
+            for filename in self.json:
+                with open(filename) as n:
+                    self.data = json.load(n)
+                if not self.data:
+                    continue
+
+                # Arrange the values positionally following the table columns, building the frame column by column
+                # rather than inferring it from one dictionary per row
+                rows = self.data.values()
+                df = pd.DataFrame({col: [row.get(col) for row in rows] for col in cols_list}, columns=cols_list)
+                df["clean_abstract"] = ""
+                df["clean_title"] = ""
+                # Store booleans the same way the connector does (0/1)
+                bool_cols = df.select_dtypes(include="bool").columns
+                df[bool_cols] = df[bool_cols].astype(int)
+
+                # Missing values are stored as NULL
+                rows = df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+                if local_infile:
+                    # Dump all the values of the file to a tab-separated file and bulk load it in a single statement
+                    with open(tmp_path, "w", encoding="utf8", newline="\n") as f:
+                        for row in rows:
+                            f.write("\t".join(map(_load_data_field, row)) + "\n")
+                    self.mycursor.execute(self.sql)
+                    self._report_load_warnings(filename, len(df))
+                else:
+                    # Insert all the values of the file in a single transaction
+                    self.mycursor.executemany(self.sql, list(rows))
                 self.mydb.commit()
+        finally:
+            os.remove(tmp_path)
 
     def close(self):
         """
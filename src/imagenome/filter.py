@@ -16,48 +16,79 @@
 import json
 import spacy
 import os.path
-import pandas as pd
-from glob import glob
-from bounded_pool_executor import BoundedProcessPoolExecutor
+import pyarrow.parquet as pq
 
-from .utils import preprocess_text_tc, timer
+from .utils import preprocess_series_tc, timer
 
 
-# Build function for workers
-def process(filename, model, save_path, max_lines=-1):
+def read_abstracts(filenames, found, max_lines=-1, verbose=False, batch_size=1024):
     """
-    This function is called by the different workers launched in parallel in :func:`~filter.Filter.filter`. It processes
-    each individual Pubmed .parquet file, running the classifier on each abstract string and then storing the whole row
-    to a dictionary with the PMID value as key, when the "POSITIVE_NUCL_MED" category > 0.5.
-    The dictionary is finally saved to a .json file.
+    Generator function feeding the text categorizer in :func:`~filter.Filter.filter`. It scans the "pmid" and
+    "abstract" columns of each individual Pubmed .parquet file in record batches and yields the preprocessed abstract
+    strings longer than 10 characters, along with the index of the source file and the row number of the entry within
+    that file as context. Files whose number of positive entries already exceeds `max_lines` stop being read.
+
+    :param filenames: paths to the source .parquet files
+    :type filenames: list(str)
+    :param found: dictionary holding the positive entries found for each source file, indexed by file position
+    :type found: dict
+    :param max_lines: max number of positive entries stored to a .json file, defaults to -1
+    :type max_lines:  int, optional
+    :param verbose: activates verbose mode if `True`, defaults to `False`
+    :type verbose: bool, optional
+    :param batch_size: number of rows read at once from the .parquet files, defaults to 1024
+    :type batch_size: int, optional
+    """
+    for index, filename in enumerate(filenames):
+        if verbose:
+            print(f'Reading file: {filename}')
+        parquet_file = pq.ParquetFile(str(filename))
+        offset = 0
+        for batch in parquet_file.iter_batches(batch_size=batch_size, columns=["abstract"]):
+            if len(found[index]) > max_lines > 0:
+                break
+            # Number the rows of the batch by their position in the file
+            table = batch.to_pandas()
+            table.index += offset
+            offset += len(table)
+
+            # Discard missing and too short abstracts before preprocessing the remaining ones
+            table = table.loc[table["abstract"].notna() & (table["abstract"].str.len() > 10)]
+            texts = preprocess_series_tc(table["abstract"]).tolist()
+            for text, row in zip(texts, table.index.tolist()):
+                if len(found[index]) > max_lines > 0:
+                    break
+                yield text, (index, row)
+
+
+def save_json(filename, found_loop, save_path):
+    """
+    Saves the positive entries found in a Pubmed .parquet file to a .json file with the same name. Only the rows of
+    the positive entries are taken from the source file, and stored to a dictionary with the PMID value as key, along
+    with their "POSITIVE_NUCL_MED" category score as "class_value"
 
     :param filename: path to the source .parquet file
     :type filename: str
-    :param model: text categorizer model
-    :type model: spaCy TextCategorizer object
-    :param save_path: path to the output .json file
+    :param found_loop: dictionary holding the "POSITIVE_NUCL_MED" category score of the positive entries with their
+                       row number in the source file as key
+    :type found_loop: dict
+    :param save_path: path to the output .json file directory
     :type save_path: str
-    :param max_lines: max number of positive entries stored to a .json file, defaults to -1
-    :type max_lines:  int, optional
     """
+    rows = {}
+    if found_loop:
+        # Select the classified rows by position, as the same PMID may appear in other rows of the file (e.g. the
+        # deleted citations listed at the end of the Medline files)
+        positive_rows = sorted(found_loop)
+        table = pq.read_table(str(filename)).take(positive_rows).to_pandas()
+        table["class_value"] = [found_loop[row] for row in positive_rows]
+        for elem in table.to_dict("records"):
+            rows[elem["pmid"]] = elem
+
     number = os.path.splitext(os.path.basename(filename))[0]
-    table = pd.read_parquet(str(filename), engine='pyarrow')
-    d = table.to_dict("index")
-    found_loop = {}
-    count = 0
-    for elem in d.values():
-        if elem["abstract"] != None:
-            if len(elem["abstract"]) > 10:
-                doc = model(preprocess_text_tc(elem["abstract"]))
-                if doc.cats["POSITIVE_NUCL_MED"] > 0.50:
-                    elem["class_value"] = doc.cats["POSITIVE_NUCL_MED"]
-                    found_loop[elem["pmid"]] = elem
-                    count = count + 1
-                    if count > max_lines > 0:
-                         break
     path = os.path.join(save_path, str(number) + ".json")
     with open(path, 'w', encoding="utf8") as n:
-        json.dump(found_loop.copy(), n)
+        json.dump(rows, n)
 
 
 class Filter:
@@ -79,7 +110,8 @@ class Filter:
         self.max_workers = None
 
         self.input_model_path = os.path.abspath(model_path)
-        self.model = spacy.load(self.input_model_path)
+        # Only the "textcat" component is used for filtering
+        self.model = spacy.load(self.input_model_path, disable=["tagger", "parser", "ner"])
 
     @timer('Filtering parsed *.parquet data using TC model... ')
     def filter(self, input_path='.', output_path='.', max_workers=1, max_lines=-1, verbose=False):
@@ -104,22 +136,36 @@ class Filter:
 
         # Build the necessary directories
         self.input_path = os.path.abspath(input_path)
-        self.parquet_files_total = glob(self.input_path + '/*')
-        self.output_path = os.path.abspath(output_path)
-        os.makedirs(self.output_path, exist_ok=True)
-        self.max_workers = max_workers
-        self.json_files_total = glob(self.output_path + '/*')
-        self.already_filtered = []
-        for elem in self.json_files_total:
-            json_number = os.path.splitext(os.path.basename(elem))[0]
-            self.already_filtered.append(os.path.join(str(self.input_path), str(json_number) + ".parquet"))
-        self.parquet_files_update = set(self.parquet_files_total) - set(self.already_filtered)
         self.output_path = os.path.abspath(output_path)
         os.makedirs(self.output_path, exist_ok=True)
         self.max_workers = max_workers
 
-        with BoundedProcessPoolExecutor(max_workers=self.max_workers) as worker:
-            for filename in self.parquet_files_update:
-                if verbose:
-                    print(f'Worker initialization: {filename}')
-                worker.submit(process, filename, self.model, self.output_path, max_lines=max_lines)
\ No newline at end of file
+        # Skip the .parquet files already having a .json file with the same name in the output directory
+        with os.scandir(self.input_path) as it:
+            self.parquet_files_total = [entry.path for entry in it if not entry.name.startswith('.')]
+        with os.scandir(self.output_path) as it:
+            self.already_filtered = {os.path.splitext(entry.name)[0] for entry in it if not entry.name.startswith('.')}
+        self.parquet_files_update = [filename for filename in self.parquet_files_total
+                                     if os.path.splitext(os.path.basename(filename))[0] not in self.already_filtered]
+
+        # Stream the abstracts of all the files through the classifier, spread over max_workers processes. The worker
+        # processes are started once for the whole stream and inherit the already loaded model, so it is neither
+        # reloaded nor pickled per file. Docs are yielded in order, so a file is fully processed as soon as a row from a
+        # later file comes out of the pipe
+        files = sorted(self.parquet_files_update)
+        found = {index: {} for index in range(len(files))}
+        n_saved = 0
+        texts = read_abstracts(files, found, max_lines=max_lines, verbose=verbose)
+        for doc, (index, row) in self.model.pipe(texts, as_tuples=True, batch_size=128, n_process=self.max_workers):
+            while n_saved < index:
+                save_json(files[n_saved], found.pop(n_saved), self.output_path)
+                n_saved += 1
+            if len(found[index]) > max_lines > 0:
+                continue
+            if doc.cats["POSITIVE_NUCL_MED"] > 0.50:
+                found[index][row] = doc.cats["POSITIVE_NUCL_MED"]
+
+        # Save the remaining files, including those without any abstract left to classify
+        while n_saved < len(files):
+            save_json(files[n_saved], found.pop(n_saved), self.output_path)
+            n_saved += 1
@@ -13,7 +13,7 @@
 # <http://www.gnu.org/licenses/>.
 # ----------------------------------------------------------------------------------------------------------------------
 
-import json
+import srsly
 import random
 import os.path
 import en_ner_jnlpba_md
@@ -49,12 +49,14 @@ class Ner:
         Constructor method.
         """
 
-        #Load nlp model and initialise attributes.
-        self.model = en_ner_jnlpba_md.load()
+        #Load nlp model (only the "ner" component is trained and used) and initialise attributes. The word vectors are
+        #kept, since the NER model features rely on them
+        self.model = en_ner_jnlpba_md.load(disable=["tagger", "parser"])
         self.output_path = None
         self.ner = self.model.get_pipe("ner")
         self.train_data = None
         self.test_data = None
+        self.test_golds = None
         self.losses = {}
         self.scores = {}
         self.metrics = {}
@@ -68,13 +70,9 @@ class Ner:
         :type input_path: str
         """
 
-        json_to_train_ents = []
-        with open(input_path, "r") as f:
-            json_list = list(f)
-            for json_str in json_list:
-                result = json.loads(json_str)
-                json_to_train_ents.append(result)
-        self.train_data = json_to_train_ents[0]
+        # The data is stored as a single JSON document in the first line of the file
+        with open(input_path, "r", encoding="utf8") as f:
+            self.train_data = srsly.json_loads(f.readline())
 
     @timer('Loading NER test data... ')
     def load_test_data(self, input_path):
@@ -85,13 +83,10 @@ class Ner:
         :type input_path: str
         """
 
-        json_to_test_ents = []
-        with open(input_path, "r") as f:
-            json_list = list(f)
-            for json_str in json_list:
-                result = json.loads(json_str)
-                json_to_test_ents.append(result)
-        self.test_data = json_to_test_ents[0]
+        # The data is stored as a single JSON document in the first line of the file
+        with open(input_path, "r", encoding="utf8") as f:
+            self.test_data = srsly.json_loads(f.readline())
+        self.test_golds = None
 
     @timer('Training NER model...\n')
     def train(self, n_iter=20):
@@ -187,11 +182,15 @@ class Ner:
         fp = 1e-8
         fn = 1e-8
 
+        # The gold standard does not change between training iterations, so it is only built once
+        if self.test_golds is None:
+            self.test_golds = [GoldParse(self.model.make_doc(input_), entities=annot["entities"])
+                               for input_, annot in self.test_data]
+
         scorer = Scorer()
-        for input_, annot in self.test_data:
-            doc_gold_text = self.model.make_doc(input_)
-            gold = GoldParse(doc_gold_text, entities=annot["entities"])
-            pred_value = self.model(input_)
+        texts = [input_ for input_, _ in self.test_data]
+        preds = self.model.pipe(texts, batch_size=128)
+        for pred_value, gold in zip(preds, self.test_golds):
             scorer.score(pred_value, gold)
 
         # Update RADIOTRACER entity scores (only)
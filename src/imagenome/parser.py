@@ -14,17 +14,124 @@
 # ----------------------------------------------------------------------------------------------------------------------
 
 import os
-import pandas as pd
+import re
+import gzip
+import requests
+import pyarrow as pa
 from glob import glob
-import pubmed_parser as pp
-from bounded_pool_executor import BoundedProcessPoolExecutor
+from lxml import etree
+import pyarrow.parquet as pq
+from itertools import repeat
+from urllib.parse import urlsplit
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pubmed_parser.medline_parser import parse_article_info
 
 from .utils import timer
 
+# Fields parsed from each PubMed/Medline article, in the same order as pubmed_parser.parse_medline_xml
+MEDLINE_FIELDS = ("title", "issue", "pages", "abstract", "journal", "authors", "pubdate", "pmid", "mesh_terms",
+                  "publication_types", "chemical_list", "keywords", "doi", "references", "delete", "affiliations",
+                  "pmc", "other_id", "medline_ta", "nlm_unique_id", "issn_linking", "country")
 
-def process_file(file, save_path, verbose=False):
+# Arrow schema of the .parquet files storing the parsed PubMed/Medline articles
+MEDLINE_SCHEMA = pa.schema([(field, pa.bool_() if field == "delete" else pa.string()) for field in MEDLINE_FIELDS])
+
+# Low cardinality fields, repeated across many articles, stored with dictionary encoding
+MEDLINE_DICTIONARY_FIELDS = ["journal", "pubdate", "publication_types", "medline_ta", "nlm_unique_id", "issn_linking",
+                             "country"]
+
+# PubMed/Medline directory downloaded by default
+PUBMED_BASELINE_URL = "ftp://ftp.ncbi.nlm.nih.gov/pubmed/baseline/"
+
+
+def list_xml_files(url):
     """
-    Reads an input PubMed/Medline .xml file, parses it and saves it as a .parquet file
+    Lists the .xml.gz files to download from a PubMed/Medline server path. The NCBI server exposes the same tree over
+    HTTPS as over FTP, so ftp:// paths are fetched through HTTPS
+
+    :param url: path to a PubMed/Medline server directory or .xml.gz file
+    :type url: str
+    :return: urls of the .xml.gz files
+    :rtype: list(str)
+    """
+    url = re.sub(r'^ftp://', 'https://', url)
+    if url.endswith('.xml.gz'):
+        return [url]
+
+    url = url if url.endswith('/') else url + '/'
+    response = requests.get(url, timeout=60)
+    response.raise_for_status()
+    return [url + name for name in dict.fromkeys(re.findall(r'href="([^"/?]+\.xml\.gz)"', response.text))]
+
+
+def download_file(url, data_path, chunk_size=1 << 20):
+    """
+    Downloads a file to the `<data_path>/<host>/<path>` location, the same layout used by `wget --mirror`. The
+    response is streamed to disk by chunks, and files already downloaded are skipped
+
+    :param url: url of the file to download
+    :type url: str
+    :param data_path: path to the directory where the file will be downloaded
+    :type data_path: str
+    :param chunk_size: number of bytes written to disk at once, defaults to 1 MiB
+    :type chunk_size: int, optional
+    """
+    parts = urlsplit(url)
+    path = os.path.join(data_path, parts.netloc, *parts.path.strip('/').split('/'))
+    if os.path.exists(path):
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # Write to a temporary file first, so that interrupted downloads are not taken as complete files
+    part_path = path + '.part'
+    try:
+        with requests.get(url, stream=True, timeout=60) as response:
+            response.raise_for_status()
+            with open(part_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    f.write(chunk)
+        os.replace(part_path, path)
+    except (requests.exceptions.RequestException, OSError):
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        print(f'WARNING! File {url} could not be downloaded')
+
+
+def iter_medline(file):
+    """
+    Generator function incrementally parsing an input PubMed/Medline .xml(.gz) file. Only one article is kept in memory
+    at a time, and it is yielded as a dictionary with the same fields as the ones returned by
+    pubmed_parser.parse_medline_xml. Deleted citations are yielded with no information other than their PMID and the
+    field "delete" being `True`
+
+    :param file: input .xml file absolute path
+    :type file: str
+    """
+    opener = gzip.open if file.endswith('.gz') else open
+    with opener(file, 'rb') as f:
+        for _, elem in etree.iterparse(f, events=("end",), tag=("PubmedArticle", "DeleteCitation")):
+            if elem.tag == "PubmedArticle":
+                yield parse_article_info(elem, year_info_only=True, nlm_category=False, author_list=False,
+                                         reference_list=False)
+            else:
+                for pmid in elem.findall("PMID"):
+                    article = dict.fromkeys(MEDLINE_FIELDS)
+                    article["pmid"] = pmid.text.strip()
+                    article["delete"] = True
+                    yield article
+
+            # Free the parsed element and the already processed siblings
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+
+
+def process_file(file, save_path, verbose=False, batch_size=8192, row_group_size=32768, compression_level=3):
+    """
+    Reads an input PubMed/Medline .xml file, parses it and saves it as a zstd compressed .parquet file. The parsed
+    articles are gathered column-wise into record batches, which are written to the .parquet file in row groups as the
+    input file is being parsed. Column statistics are stored for every row group, so that readers can skip the row
+    groups (and the columns) they do not need
 
     :param file: input .xml file absolute path
     :type file: str
@@ -32,21 +139,52 @@ def process_file(file, save_path, verbose=False):
     :type save_path: str
     :param verbose: activates verbose mode if `True`, defaults to `False`
     :type verbose: bool, optional
+    :param batch_size: number of articles gathered at once into a record batch, defaults to 8192
+    :type batch_size: int, optional
+    :param row_group_size: number of articles written at once to the .parquet file as a row group, defaults to 32768
+    :type row_group_size: int, optional
+    :param compression_level: zstd compression level of the .parquet file, defaults to 3
+    :type compression_level: int, optional
     """
     if verbose:
         print(f'\nStart processing file {file} ...')
 
+    number = file[-11:-7]
+    path = os.path.join(save_path, str(number) + ".parquet")
     try:
-        pp_list = pp.parse_medline_xml(file)
-    except:
+        with pq.ParquetWriter(path, MEDLINE_SCHEMA, compression='zstd', compression_level=compression_level,
+                              use_dictionary=MEDLINE_DICTIONARY_FIELDS, write_statistics=True) as writer:
+            columns = {field: [] for field in MEDLINE_FIELDS}
+            batches = []
+            n_articles = 0
+            n_rows = 0
+            for article in iter_medline(file):
+                for field in MEDLINE_FIELDS:
+                    columns[field].append(article.get(field))
+                n_articles += 1
+                if n_articles == batch_size:
+                    batches.append(pa.RecordBatch.from_pydict(columns, schema=MEDLINE_SCHEMA))
+                    columns = {field: [] for field in MEDLINE_FIELDS}
+                    n_rows += n_articles
+                    n_articles = 0
+                    # Each write produces its own row groups, so the record batches are written together once they
+                    # fill a whole row group
+                    if n_rows >= row_group_size:
+                        writer.write_table(pa.Table.from_batches(batches, schema=MEDLINE_SCHEMA),
+                                           row_group_size=row_group_size)
+                        batches = []
+                        n_rows = 0
+            if n_articles > 0:
+                batches.append(pa.RecordBatch.from_pydict(columns, schema=MEDLINE_SCHEMA))
+            if batches:
+                writer.write_table(pa.Table.from_batches(batches, schema=MEDLINE_SCHEMA), row_group_size=row_group_size)
+    except Exception:
+        # Do not leave partially written files behind
+        if os.path.exists(path):
+            os.remove(path)
         print('\nWARNING! file ' + file + ' is corrupt and could not be loaded. Please, remove the corrupt file and '
               'download it again.')
     else:
-        pp_df = pd.DataFrame(pp_list)
-        number = file[-11:-7]
-        path = os.path.join(save_path, str(number) + ".parquet")
-        pp_df.to_parquet(path, engine='pyarrow')
-
         if verbose:
             print(f'{file} was successfully processed...')
 
@@ -68,29 +206,26 @@ class Parser:
         self.pubmed_files = None
 
     @timer('Downloading files from ftp server... ')
-    def download(self, data_path='.', ftp_list=[]):
+    def download(self, data_path='.', ftp_list=[], max_workers=8):
         """
-        Downloads the PubMed/Medline database from the ftp server to a specified directory path
+        Downloads the PubMed/Medline database from the ftp server to a specified directory path. The .xml.gz files are
+        downloaded concurrently, and stored following the server directory tree
 
         :param data_path: path to the directory where the PubMed/Medline database will be downloaded, defaults to "."
         :type data_path: str, optional
         :param ftp_list: list of paths to the PubMed/Medline ftp server directories/files to download, defaults as an
                          empty list
         :type ftp_list: list, optional
+        :param max_workers: maximum number of files downloaded at the same time, defaults to 8
+        :type max_workers: int, optional
         """
-        # Store current working direcotry
-        cwd = os.getcwd()
+        # Create specified directory (if not existing) and download files
         self.data_path = os.path.abspath(data_path)
-
-        # Create specified directory (if not existing) and download files, then return to previous working directory
         os.makedirs(self.data_path, exist_ok=True)
-        os.chdir(self.data_path)
-        if ftp_list:
-            for ftp_path in ftp_list:
-                os.system('wget -q --mirror --accept "*.xml.gz" ' + ftp_path)
-        else:
-            os.system('wget -q --mirror --accept "*.xml.gz" ftp://ftp.ncbi.nlm.nih.gov/pubmed/baseline/')
-        os.chdir(cwd)
+
+        urls = [url for ftp_path in (ftp_list or [PUBMED_BASELINE_URL]) for url in list_xml_files(ftp_path)]
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(download_file, urls, repeat(self.data_path)))
 
     @timer('Parsing raw text files and saving the results in *.parquet format... ')
     def parse(self, data_path='.', output_path='.', max_workers=1, verbose=False):
@@ -119,9 +254,6 @@ class Parser:
         os.makedirs(self.output_path, exist_ok=True)
         self.max_workers = max_workers
 
-        # Launch workers for parallel mapping
-        with BoundedProcessPoolExecutor(max_workers=self.max_workers) as worker:
-            for filename in self.pubmed_files:
-                if verbose:
-                    print(f'Worker initialization: {filename}')
-                worker.submit(process_file, filename, self.output_path)
\ No newline at end of file
+        # Launch workers for parallel mapping. Exceptions raised by the workers are propagated when collecting results
+        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            list(executor.map(process_file, self.pubmed_files, repeat(self.output_path), repeat(verbose), chunksize=4))
@@ -14,9 +14,9 @@
 # ----------------------------------------------------------------------------------------------------------------------
 
 import os
-import json
-import random
+import srsly
 
+import numpy as np
 import en_core_sci_md
 import matplotlib.pyplot as plt
 from spacy.util import minibatch, compounding
@@ -24,18 +24,76 @@ from spacy.util import minibatch, compounding
 from .utils import preprocess_text_tc, timer
 
 
+def get_golds(cats):
+    """
+    Gathers the 'POSITIVE_NUCL_MED' gold standard values from a list of categories
+
+    :param cats: categories used as gold standard
+    :type cats: list(dict)
+
+    :return: 'POSITIVE_NUCL_MED' gold standard values (`NaN` for entries without this category)
+    :rtype: numpy.ndarray
+    """
+    return np.array([cat["cats"].get("POSITIVE_NUCL_MED", np.nan) for cat in cats], dtype=np.float64)
+
+
+def get_metrics(scores, golds, thr=0.5):
+    """
+    Computes the performance metrics of the model from the 'POSITIVE_NUCL_MED' prediction scores and gold standard
+    values, counting the true/false positives/negatives with vectorized boolean masks
+
+    :param scores: 'POSITIVE_NUCL_MED' prediction scores of the texts
+    :type scores: numpy.ndarray
+    :param golds: 'POSITIVE_NUCL_MED' gold standard values of the texts (`NaN` for texts without this category, which
+                  are ignored)
+    :type golds: numpy.ndarray
+    :param thr: prediction score threshold for category 'POSITIVE_NUCL_MED', defaults to 0.5
+    :type thr: float, optional
+
+    :return: dictionary containing the precision, recall, F-score and specificity of the model
+    :rtype: dict
+    """
+    pred = scores >= thr
+    pos = golds >= 0.5
+    neg = golds < 0.5
+    tp = float(np.count_nonzero(pred & pos))  # True positives
+    fp = float(np.count_nonzero(pred & neg)) + 1e-8  # False positives
+    fn = float(np.count_nonzero(~pred & pos)) + 1e-8  # False negatives
+    tn = float(np.count_nonzero(~pred & neg))  # True negatives
+    precision = tp / (tp + fp)
+    recall = tp / (tp + fn)
+    specificity = tn / (tn + fp)
+    if (precision + recall) == 0:
+        f_score = 0.0
+    else:
+        f_score = 2 * (precision * recall) / (precision + recall)
+    return {"textcat_p": precision, "textcat_r": recall, "textcat_f": f_score, "textcat_s": specificity}
+
+
 class TextClassification:
 
     """
     A class to train a Text Categorizer model to identify Nuclear Medicine texts
+
+    :param remove_pipes: removes the "tagger", "parser" and "ner" components of the loaded spaCy model if `True`, as
+                         only its tokenizer (and the "textcat" component added for training) are used, defaults to
+                         `True`
+    :type remove_pipes: bool, optional
     """
 
-    def __init__(self):
+    def __init__(self, remove_pipes=True):
         # Load NLP model and initialise attributes.
         self.model = en_core_sci_md.load()
+        if remove_pipes:
+            for pipe in list(self.model.pipe_names):
+                if pipe != 'textcat':
+                    self.model.remove_pipe(pipe)
         self.output_path = None
         self.train_data = None
         self.test_data = None
+        self.dev_texts = None
+        self.dev_texts_pp = None
+        self.dev_cats = None
         self.textcat = None
         self.losses = {}
         self.scores = {}
@@ -44,36 +102,33 @@ class TextClassification:
     @timer('Loading TC training data... ')
     def load_train_data(self, input_path):
         """
-        Loads training data from .json file
+        Loads training data from .json file, preprocessing the training texts once so that they can be reused on
+        every training iteration
 
         :param input_path: path to .json file containing training data
         :type input_path: str
         """
-        json_to_train_ents = []
-        with open(input_path, "r") as f:
-            json_list = list(f)
-            for json_str in json_list:
-                result = json.loads(json_str)
-                json_to_train_ents.append(result)
-        self.train_data = json_to_train_ents[0]
+        # The data is stored as a single JSON document in the first line of the file
+        with open(input_path, "r", encoding="utf8") as f:
+            json_to_train_ents = srsly.json_loads(f.readline())
+        self.train_data = [(preprocess_text_tc(text), annotations) for text, annotations in json_to_train_ents]
 
     @timer('Loading TC test data... ')
     def load_test_data(self, input_path):
         """
-        Loads test data from .json file
+        Loads test data from .json file, keeping a preprocessed copy of the test texts used for evaluation during
+        training
 
         :param input_path: path to .json file containing test data
         :type input_path: str
         """
 
-        json_to_test_ents = []
-        with open(input_path, "r") as f:
-            json_list = list(f)
-            for json_str in json_list:
-                result = json.loads(json_str)
-                json_to_test_ents.append(result)
-        self.test_data = json_to_test_ents[0]
+        # The data is stored as a single JSON document in the first line of the file
+        with open(input_path, "r", encoding="utf8") as f:
+            json_to_test_ents = srsly.json_loads(f.readline())
+        self.test_data = json_to_test_ents
         (self.dev_texts, self.dev_cats) = zip(*self.test_data)
+        self.dev_texts_pp = [preprocess_text_tc(text) for text in self.dev_texts]
 
     def add_pipe(self):
         """
@@ -85,7 +140,7 @@ class TextClassification:
         self.textcat.add_label("POSITIVE_NUCL_MED")
         self.textcat.add_label("NEGATIVE_NUCL_MED")
 
-    def evaluate(self, tokenizer, textcat, texts, cats, thr=0.5):
+    def evaluate(self, tokenizer, textcat, texts, cats, thr=0.5, n_process=1):
         """
         Computes the training performance metrics of the model
 
@@ -99,35 +154,34 @@ class TextClassification:
         :type cats: list(str)
         :param thr: prediction score threshold for category 'POSITIVE_NUCL_MED', defaults to 0.5
         :type thr: float, optional
+        :param n_process: number of processes used to run the model over the texts. If greater than 1, the texts are
+                          processed with the whole (enabled) pipeline of the loaded model, defaults to 1
+        :type n_process: int, optional
         """
-        docs = (tokenizer(text) for text in texts)
-        tp = 0.0  # True positives
-        fp = 1e-8  # False positives
-        fn = 1e-8  # False negatives
-        tn = 0.0  # True negatives
-        for i, doc in enumerate(textcat.pipe(docs)):
-            gold = cats[i]["cats"]
-            for label, score in doc.cats.items():
-                if label not in gold:
-                    continue
-                if label == "NEGATIVE_NUCL_MED":
-                    continue
-                if score >= thr and gold[label] >= 0.5:
-                    tp += 1.0
-                elif score >= thr and gold[label] < 0.5:
-                    fp += 1.0
-                elif score < thr and gold[label] < 0.5:
-                    tn += 1
-                elif score < thr and gold[label] >= 0.5:
-                    fn += 1
-        precision = tp / (tp + fp)
-        recall = tp / (tp + fn)
-        specificity = tn / (tn + fp)
-        if (precision + recall) == 0:
-            f_score = 0.0
+        if n_process > 1:
+            # The worker processes are forked when the pipe starts, so they run with the model weights currently in
+            # use (e.g. the averaged ones set during training)
+            docs = self.model.pipe(texts, batch_size=64, n_process=n_process)
         else:
-            f_score = 2 * (precision * recall) / (precision + recall)
-        return {"textcat_p": precision, "textcat_r": recall, "textcat_f": f_score, "textcat_s": specificity}
+            docs = textcat.pipe(tokenizer.pipe(texts, batch_size=128), batch_size=128)
+        scores = np.fromiter((doc.cats["POSITIVE_NUCL_MED"] for doc in docs), dtype=np.float64, count=len(texts))
+        return get_metrics(scores, get_golds(cats), thr=thr)
+
+    def get_scores(self, texts):
+        """
+        Computes the 'POSITIVE_NUCL_MED' prediction scores of the model for the input texts
+
+        :param texts: input texts
+        :type texts: list(str)
+
+        :return: 'POSITIVE_NUCL_MED' prediction scores
+        :rtype: numpy.ndarray
+        """
+        # Run the texts through a single batched pipe with only the "textcat" component enabled
+        other_pipes = [pipe for pipe in self.model.pipe_names if pipe != 'textcat']
+        with self.model.disable_pipes(*other_pipes):
+            docs = self.model.pipe(texts, batch_size=128)
+            return np.fromiter((doc.cats["POSITIVE_NUCL_MED"] for doc in docs), dtype=np.float64, count=len(texts))
 
 
     def get_roc_auc(self, texts, cats, delta_thr=0.01, plot_roc=False):
@@ -148,18 +202,25 @@ class TextClassification:
         :rtype: tuple(float, list, list)
         """
 
+        # Run the model only once, the threshold sweep is performed over the stored scores
+        scores = self.get_scores(texts)
+        golds = get_golds(cats)
+        pos = golds >= 0.5
+        neg = golds < 0.5
+
+        # Sweep classification threshold values from 1.0 to 0.0 for proper sorting
         N = int(1/delta_thr)
-        tpr = list()
-        fpr = list()
-        for i in reversed(range(N+1)): # Sweep classification threshold values from 1.0 to 0.0 for proper sorting
-            scores = self.evaluate(self.model.tokenizer, self.textcat, texts, cats, thr=i/N)
-            tpr.append(scores["textcat_r"])
-            fpr.append(1-scores["textcat_s"])
+        thr = np.arange(N, -1, -1)[:, np.newaxis] / N
+        pred = scores >= thr
+        tp = np.count_nonzero(pred & pos, axis=1)
+        fp = np.count_nonzero(pred & neg, axis=1) + 1e-8
+        fn = np.count_nonzero(~pred & pos, axis=1) + 1e-8
+        tn = np.count_nonzero(~pred & neg, axis=1)
+        tpr = (tp / (tp + fn)).tolist()
+        fpr = (1 - tn / (tn + fp)).tolist()
 
         # Integrate area under ROC curve using trapezoidal rule (precision will strongly depend on delta_thr)
-        auc = 0
-        for i in range(len(fpr) - 1):
-            auc += (fpr[i + 1] - fpr[i]) * (tpr[i + 1] + tpr[i]) / 2.0
+        auc = float(np.trapz(tpr, fpr))
 
         if plot_roc:
             plt.figure()
@@ -173,12 +234,13 @@ class TextClassification:
         return auc, fpr, tpr
 
 
-    def get_auc_Nsq(self, texts, cats, s_frac=1.0):
+    def get_auc_Nsq(self, texts, cats, s_frac=1.0, seed=None):
 
         """
         Computes the receiver operating characteristic (ROC) area under curve (AUC) of the model using Algorithm 1 of
         reference “Fawcett, Tom. (2004). ROC Graphs: Notes and Practical Considerations for Researchers. Machine
-        Learning. 31. 1-38.”, having a computational cost of :math:`O(N^2)` with :math:`N` being the test sample size
+        Learning. 31. 1-38.”, having a computational cost of :math:`O(N^2)` with :math:`N` being the test sample size.
+        The pairwise comparisons are counted over the sorted scores, which reduces the cost to :math:`O(N \\log N)`
 
         :param texts: texts used for training metrics computation
         :type texts: list(str)
@@ -186,6 +248,8 @@ class TextClassification:
         :type cats: list(str)
         :param s_frac: fraction of the total input test data used to compute the ROC AUC, defaults to 1.0
         :type s_frac: float, optional
+        :param seed: seed of the random generator used to sample the test data, defaults to None
+        :type seed: int, optional
 
         :return: ROC AUC value
         :rtype: float
@@ -194,7 +258,10 @@ class TextClassification:
         pos = list()
         neg = list()
         s = int(s_frac*len(texts))
-        for text, cat in random.sample(list(zip(texts, cats)), s):
+        # Sample indices rather than (text, category) pairs, so that only the sampled entries are gathered
+        idx = np.random.default_rng(seed).choice(len(texts), size=s, replace=False)
+        for i in idx:
+            text, cat = texts[i], cats[i]
             if cat["cats"]["POSITIVE_NUCL_MED"] == 1.0 and cat["cats"]["NEGATIVE_NUCL_MED"] == 0.0:
                 pos.append(text)
             elif cat["cats"]["POSITIVE_NUCL_MED"] == 0.0 and cat["cats"]["NEGATIVE_NUCL_MED"] == 1.0:
@@ -202,17 +269,16 @@ class TextClassification:
             else:
                 continue
 
+        # Score each text only once
+        scores = self.get_scores(pos + neg)
+        pos_scores = scores[:len(pos)]
+        neg_scores = np.sort(scores[len(pos):])
+
+        # Count the (positive, negative) pairs in which the positive text scores greater than or equal to the
+        # negative one
+        # The division is done on Python ints, so an empty class raises ZeroDivisionError as in get_auc_Nlog2N
         N = len(pos) * len(neg)
-        auc = 0.0
-        for p in pos:
-            doc_pos = self.model.tokenizer(p)
-            doc_pos = self.textcat(doc_pos)
-            for n in neg:
-                doc_neg = self.model.tokenizer(n)
-                doc_neg = self.textcat(doc_neg)
-                if doc_pos.cats["POSITIVE_NUCL_MED"] >= doc_neg.cats["POSITIVE_NUCL_MED"]:
-                    auc += 1.0
-        auc /= N
+        auc = int(np.searchsorted(neg_scores, pos_scores, side='right').sum()) / N
 
         return auc
 
@@ -234,8 +300,20 @@ class TextClassification:
         :rtype: float
         """
 
-        scores = [self.textcat(self.model.tokenizer(text)).cats["POSITIVE_NUCL_MED"] for text in texts]
-        sort_idx = list(reversed([i[0] for i in sorted(enumerate(scores), key=lambda x: x[1])]))
+        scores = self.get_scores(texts)
+        # Indices sorted by decreasing score, with tied texts in reverse input order
+        sort_idx = np.argsort(scores, kind='stable')[::-1]
+
+        # Positive and negative gold standard labels, gathered once instead of being looked up on every iteration
+        y_pos = np.array([cat["cats"]["POSITIVE_NUCL_MED"] == 1.0 and cat["cats"]["NEGATIVE_NUCL_MED"] == 0.0
+                          for cat in cats], dtype=bool)
+        y_neg = np.array([cat["cats"]["POSITIVE_NUCL_MED"] == 0.0 and cat["cats"]["NEGATIVE_NUCL_MED"] == 1.0
+                          for cat in cats], dtype=bool)
+
+        # Scores and labels following the sorted order, as lists for fast scalar access within the loop
+        scores_sorted = scores[sort_idx].tolist()
+        pos_sorted = y_pos[sort_idx].tolist()
+        neg_sorted = y_neg[sort_idx].tolist()
 
         n_pos = 0
         n_neg = 0
@@ -243,27 +321,27 @@ class TextClassification:
         n_pos_eq = 0
         n_pos_gr = 0
         auc = 0
-        for i, j in enumerate(sort_idx):
+        for i in range(len(scores_sorted)):
 
-            if i != 0 and scores[j] == scores[sort_idx[i-1]]:
-                if cats[sort_idx[i-1]]["cats"]["POSITIVE_NUCL_MED"] == 1.0 and cats[sort_idx[i-1]]["cats"]["NEGATIVE_NUCL_MED"] == 0.0:
+            if i != 0 and scores_sorted[i] == scores_sorted[i-1]:
+                if pos_sorted[i-1]:
                     n_pos_eq += 1
-                elif cats[sort_idx[i-1]]["cats"]["POSITIVE_NUCL_MED"] == 0.0 and cats[sort_idx[i-1]]["cats"]["NEGATIVE_NUCL_MED"] == 1.0:
+                elif neg_sorted[i-1]:
                     n_neg_eq += 1
             else:
                 n_neg_eq = 0
                 n_pos_eq = 0
 
-            if cats[j]["cats"]["POSITIVE_NUCL_MED"] == 1.0 and cats[j]["cats"]["NEGATIVE_NUCL_MED"] == 0.0:
+            if pos_sorted[i]:
                 n_pos_eq += 1
                 n_pos += 1
-            elif cats[j]["cats"]["POSITIVE_NUCL_MED"] == 0.0 and cats[j]["cats"]["NEGATIVE_NUCL_MED"] == 1.0:
+            elif neg_sorted[i]:
                 n_neg_eq += 1
                 n_neg += 1
 
             auc += n_neg_eq*n_pos_gr + (n_pos_eq*n_neg_eq)/2.0
 
-            if cats[j]["cats"]["POSITIVE_NUCL_MED"] == 1.0 and cats[j]["cats"]["NEGATIVE_NUCL_MED"] == 0.0:
+            if pos_sorted[i]:
                 n_pos_gr += 1
 
         auc /= (n_pos*n_neg)
@@ -271,7 +349,7 @@ class TextClassification:
         return auc
 
     @timer('Training TC model...\n')
-    def train(self, add_pipe=True, n_iter=10):
+    def train(self, add_pipe=True, n_iter=10, n_process=1):
         """
         Trains spaCy's TextCategorizer model
 
@@ -279,6 +357,9 @@ class TextClassification:
         :type add_pipe: bool, optional
         :param n_iter: number of iterations for the TextCategorizer model training, defaults to 10
         :type n_iter: int, optional
+        :param n_process: number of processes used to evaluate the model on the test data after each iteration,
+                          defaults to 1
+        :type n_process: int, optional
         """
         if add_pipe:
             self.add_pipe()
@@ -304,13 +385,12 @@ class TextClassification:
                 batches = minibatch(self.train_data, size=compounding(4., 32., 1.001))
                 for batch in batches:
                     texts, annotations = zip(*batch)
-                    self.model.update([preprocess_text_tc(text) for text in texts], annotations,
-                                      sgd=optimizer, drop=0.2, losses=self.losses)
+                    self.model.update(texts, annotations, sgd=optimizer, drop=0.2, losses=self.losses)
 
                 # Calling the self.evaluate() function and printing the scores
                 with self.textcat.model.use_params(optimizer.averages):
-                    self.scores = self.evaluate(self.model.tokenizer, self.textcat,
-                                                [preprocess_text_tc(text) for text in self.dev_texts], self.dev_cats)
+                    self.scores = self.evaluate(self.model.tokenizer, self.textcat, self.dev_texts_pp, self.dev_cats,
+                                                n_process=n_process)
                 print('\t{0:.3f}\t{1:.3f}\t{2:.3f}\t{3:.3f}'
                       .format(self.losses['textcat'],
                               self.scores['textcat_p'], self.scores['textcat_r'], self.scores['textcat_f']))
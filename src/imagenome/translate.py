@@ -15,14 +15,104 @@
 
 import os
 import mygene
+import requests
 import numpy as np
 import pandas as pd
+from time import sleep
+from itertools import chain, repeat
+from concurrent.futures import ThreadPoolExecutor
+
+# Fields retrieved from the mygene REST API for each protein
+QUERY_FIELDS = "symbol,name,ensembl"
+
+# File extensions read and written as Excel files, any other file is handled as a .parquet file
+EXCEL_EXTENSIONS = (".xlsx", ".xls")
+
+
+def _read_table(path):
+    """
+    Loads a .parquet file (or an Excel file, kept for compatibility with the previous exports) as a Pandas dataframe
+
+    :param path: path to the input file
+    :type path: str
+    :rtype: pandas.DataFrame
+    """
+    if path.lower().endswith(EXCEL_EXTENSIONS):
+        return pd.read_excel(path)
+    return pd.read_parquet(path, engine='pyarrow')
+
+
+def _write_table(df, path):
+    """
+    Saves a Pandas dataframe to a .parquet file (or to an Excel file, depending on the file extension)
+
+    :param df: dataframe to save
+    :type df: pandas.DataFrame
+    :param path: path to the output file
+    :type path: str
+    """
+    if path.lower().endswith(EXCEL_EXTENSIONS):
+        df.to_excel(path, index=False)
+    else:
+        df.to_parquet(path, engine='pyarrow', compression='zstd', index=False)
+
+
+def _query_chunk(mg, queries, scopes, max_retries=3):
+    """
+    Queries a chunk of proteins to the mygene REST API, retrying with exponential backoff (1s, 2s, 4s...) when the
+    request fails. The chunk is skipped with a warning if it still fails after `max_retries` retries
+
+    :param mg: mygene client
+    :type mg: mygene.MyGeneInfo
+    :param queries: proteins to query
+    :type queries: list(str)
+    :param scopes: comma-separated mygene fields matched against the protein names
+    :type scopes: str
+    :param max_retries: maximum number of retries of a failed request, defaults to 3
+    :type max_retries: int, optional
+    :return: output of mygene's `querymany`, one dictionary per hit or missing query term
+    :rtype: list(dict)
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            return mg.querymany(queries, scopes=scopes, species='human', fields=QUERY_FIELDS, verbose=False)
+        except requests.exceptions.RequestException:
+            if attempt < max_retries:
+                sleep(2 ** attempt)
+    print(f"WARNING! Query failed for proteins {queries[0]} to {queries[-1]}, they will not be translated")
+    return []
+
+
+def _best_hits(results):
+    """
+    Keeps the first (best scored) hit found for each query term in the output of mygene's `querymany`
+
+    :param results: output of mygene's `querymany`, one dictionary per hit or missing query term
+    :type results: list(dict)
+    :return: dictionary holding the best hit found with the query term as key
+    :rtype: dict
+    """
+    hits = {}
+    for hit in results:
+        if not hit.get("notfound", False) and hit["query"] not in hits:
+            hits[hit["query"]] = hit
+    return hits
+
+
+def _ensembl_gene(hit):
+    """
+    Returns the Ensembl gene of a mygene hit, or NaN if missing
+    """
+    ensembl = hit.get("ensembl")
+    if isinstance(ensembl, dict) and "gene" in ensembl:
+        return str(ensembl["gene"])
+    return np.nan
 
 
 class Translate:
     """
-    A class to perform protein to gene translation using as input an Excel file exported from the Imagenome MySQL
-    database
+    A class to perform protein to gene translation using as input a .parquet (or Excel) file exported from the
+    Imagenome MySQL database
     """
 
     def __init__(self):
@@ -35,36 +125,49 @@ class Translate:
         self.mg = None
         self.g = None
 
-    def translate(self, input_excel_path=".", output_excel_path="."):
+    def translate(self, input_excel_path=".", output_excel_path=".", scopes="symbol,alias,name", max_workers=16,
+                  chunk_size=500):
         """
-        Performs protein to gene translation using as input an Excel file exported from the Imagenome MySQL database.
-        Loads the file as a Pandas dataframe, reads the column "protein_1_abstract", creates three new columns
-        ("SIMILAR_PROTEIN", "SIMILAR_GENE_LIST", "SIMILAR_ENSEMBL"), makes a query to the mygene REST API and fills
-        these columns with the results. Lastly, it saves the new dataframe to an output Excel file
+        Performs protein to gene translation using as input a .parquet file exported from the Imagenome MySQL
+        database (Excel files are also accepted, depending on the file extension). Loads the file as a Pandas
+        dataframe, reads the column "protein_1_abstract", creates three new columns ("SIMILAR_PROTEIN",
+        "SIMILAR_GENE_LIST", "SIMILAR_ENSEMBL"), makes a batched query to the mygene REST API with all the distinct
+        proteins and fills these columns with the best hit found for each one of them. Lastly, it saves the new
+        dataframe to an output .parquet (or Excel) file
 
-        :param input_excel_path: path to the Excel file exported from the Imagenome sql database, defaults to "."
+        :param input_excel_path: path to the .parquet or Excel file exported from the Imagenome sql database, defaults
+                                 to "."
         :type input_excel_path: str, optional
-        :param output_excel_path: name of the output annotated Excel file, defaults to "."
+        :param output_excel_path: path to the output annotated .parquet or Excel file. If a directory is given, the
+                                  output is saved to it as "<input file name>_translated.parquet", defaults to "."
         :type output_excel_path: str, optional
-
+        :param scopes: comma-separated mygene fields matched against the protein names, defaults to "symbol,alias,name"
+        :type scopes: str, optional
+        :param max_workers: maximum number of concurrent requests to the mygene REST API, defaults to 16
+        :type max_workers: int, optional
+        :param chunk_size: number of proteins sent per request, defaults to 500
+        :type chunk_size: int, optional
         """
         self.input_excel_path = os.path.abspath(input_excel_path)
         self.output_excel_path = os.path.abspath(output_excel_path)
-        self.df = pd.read_excel(self.input_excel_path)
-        self.df["SIMILAR_PROTEIN"] = np.nan
-        self.df["SIMILAR_GENE_LIST"] = np.nan
-        self.df["SIMILAR_ENSEMBL"] = np.nan
+        if os.path.isdir(self.output_excel_path):
+            name = os.path.splitext(os.path.basename(self.input_excel_path))[0]
+            self.output_excel_path = os.path.join(self.output_excel_path, name + "_translated.parquet")
+        self.df = _read_table(self.input_excel_path)
         self.mg = mygene.MyGeneInfo()
 
-        for index, row in self.df.iterrows():
-            protein = row["protein_1_abstract"]
-            try:
-                self.g = self.mg.query(protein, species='human', fields= 'symbol,name,ensembl')
-                if self.g["hits"] != []:
-                    self.df.loc[index, "SIMILAR_PROTEIN"] = str(self.g["hits"][0]["name"])
-                    if "ensembl" in self.g["hits"][0].keys():
-                        self.df.loc[index, "SIMILAR_ENSEMBL"] = str(self.g["hits"][0]["ensembl"]["gene"])
-                    if "symbol" in self.g["hits"][0].keys():
-                        self.df.loc[index, "SIMILAR_GENE_LIST"] = str(self.g["hits"][0]["symbol"])
-            except:
-                pass
\ No newline at end of file
+        # Query the distinct proteins in chunks, overlapping the requests in a pool of threads
+        proteins = self.df["protein_1_abstract"]
+        queries = proteins.dropna().astype(str).unique().tolist()
+        chunks = [queries[i:i + chunk_size] for i in range(0, len(queries), chunk_size)]
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = executor.map(_query_chunk, repeat(self.mg), chunks, repeat(scopes))
+            self.g = _best_hits(chain.from_iterable(results))
+
+        # Align the hits back to the rows of the dataframe and fill whole columns at once
+        hits = [self.g.get(str(protein), {}) if pd.notna(protein) else {} for protein in proteins]
+        self.df["SIMILAR_PROTEIN"] = [str(hit["name"]) if "name" in hit else np.nan for hit in hits]
+        self.df["SIMILAR_GENE_LIST"] = [str(hit["symbol"]) if "symbol" in hit else np.nan for hit in hits]
+        self.df["SIMILAR_ENSEMBL"] = [_ensembl_gene(hit) for hit in hits]
+
+        _write_table(self.df, self.output_excel_path)
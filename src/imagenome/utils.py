@@ -13,14 +13,20 @@
 # <http://www.gnu.org/licenses/>.
 # ----------------------------------------------------------------------------------------------------------------------
 
-from time import time
+import sys
+from time import perf_counter_ns
 from functools import wraps
 from string import punctuation
 
+# Translation table used by the text preprocessing, replacing newlines and tabs with spaces and removing punctuation
+# (brackets, dashes and percentages are kept)
+_TRANSLATION_TABLE = str.maketrans({**{c: None for c in punctuation if c not in "()[]{}-%"}, "\n": " ", "\t": " "})
+
 
 def timer(s):
     """
     Decorator function that times the execution of the given input function and prints the resulting time in seconds
+    to the standard error, measured with a monotonic high resolution clock
 
     :param s: initial string printed by the timer
     :type s: str
@@ -28,11 +34,12 @@ def timer(s):
     def wrap(f):
         @wraps(f)
         def wrapped(*args, **kwargs):
-            print(s, end='')
-            t1 = time()
+            sys.stderr.write(s)
+            sys.stderr.flush()
+            t1 = perf_counter_ns()
             result = f(*args, **kwargs)
-            t2 = time()
-            print(f'Process finished successfully in {(t2-t1):.4f}s')
+            t2 = perf_counter_ns()
+            sys.stderr.write(f'Process finished successfully in {(t2-t1)/1e9:.4f}s\n')
             return result
         return wrapped
     return wrap
@@ -47,16 +54,15 @@ def preprocess_text_tc(text):
     :param text: input text to be preprocessed
     :type text: str
     """
-    allow = ['(', ')', '[', ']', '{', '}', '-', '%']
-
-    text = text.strip().lower()
-
-    for char in ['\n', '\t']:
-        text = text.replace(char, ' ')
+    return text.strip().lower().translate(_TRANSLATION_TABLE)
 
-    for char in punctuation:
-        if char not in allow:
-            text = text.replace(char, '')
 
-    return text
+def preprocess_series_tc(texts):
+    """
+    Vectorized version of :func:`~utils.preprocess_text_tc`, preprocessing a whole column of texts at once with pandas
+    string methods.
 
+    :param texts: input texts to be preprocessed
+    :type texts: pandas.Series
+    """
+    return texts.str.strip().str.lower().str.translate(_TRANSLATION_TABLE)
\ No newline at end of file